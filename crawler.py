@@ -7,32 +7,386 @@ without requiring a Flickr API key. It uses direct URL access to public photos
 and attempts to get the highest resolution available through multiple methods.
 """
 
+import argparse
+import contextlib
 import os
-import sys
+import queue
 import time
 import re
+import io
+import itertools
 import json
+import logging
+import shutil
+import socket
+import threading
 import requests
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urljoin, urlsplit
 import concurrent.futures
-from PIL import Image
+from enum import IntEnum
+from PIL import Image, ImageFile
+
+logger = logging.getLogger(__name__)
+
+# httpx is optional and only needed for the HTTP/2 client
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# An HTML parser is only needed when the fast regex path misses, so it is
+# imported on first use by parse_html
+_html_parse = None
+_html_backend = None
+
+# Hosts that every crawl talks to; their DNS answers are resolved once and reused
+FLICKR_HOSTS = ('www.flickr.com', 'live.staticflickr.com')
+
+# Flickr puts the og:image / twitter:image tags and the main photo near the top
+# of the page. _scan_page only uses these matches to stop reading the page early
+# once one of them holds a staticflickr URL of the photo; the named groups just
+# tell it which alternative matched and are not turned into sizes
+IMAGE_URL_RE = re.compile(
+    rb'<meta\s+property="og:image"\s+content="(?P<og>[^"]+)"'
+    rb'|<meta\s+name="twitter:image"\s+content="(?P<twitter>[^"]+)"'
+    rb'|<img[^>]*\sclass="main-photo[^"]*"[^>]*\ssrc="(?P<main>[^"]+)"'
+)
+# Text on the page Flickr shows instead of a private photo
+PRIVATE_PAGE_MARKER = b"This photo is private"
+HTML_CHUNK_BYTES = 16384
+# Stop scanning for the image URL after this many bytes of the page
+HTML_SCAN_LIMIT = 131072
+# Bytes of the previous chunk rescanned so tags split across chunks still match
+HTML_SCAN_OVERLAP = 2048
+# A partly read HTTP/1.1 response with fewer than this many bytes left is read
+# to the end so its connection can be reused, instead of being closed
+RELEASE_DRAIN_LIMIT = 1 << 16
+
+# Server, photo ID and secret of a staticflickr image URL; enough to build the
+# URL of every public size of that photo
+STATIC_URL_RE = re.compile(rb'staticflickr\.com/(\d+)/(\d+)_([0-9a-f]+)')
+# The same, for URLs that have already been decoded
+STATIC_URL_TEXT_RE = re.compile(STATIC_URL_RE.pattern.decode())
+
+# URL suffix of each standard Flickr size
+SIZE_SUFFIXES = {
+    "Large": "_b.jpg",
+    "Medium 800": "_c.jpg",
+    "Medium 640": "_z.jpg",
+    "Medium": ".jpg",
+    "Small 320": "_n.jpg",
+    "Small": "_m.jpg",
+}
+
+# A staticflickr image URL, capturing it without its size suffix (e.g. "_m",
+# "_sq", "_b") and file extension, and capturing its photo ID
+FLICKR_BASE_RE = re.compile(
+    r'((?:https?:)?//[\w.-]*staticflickr\.com/[\w/]+?/(\d+)_[0-9a-f]+)(?:_[a-z]{1,2})?\.(?:jpg|jpeg|png|gif)'
+)
+
+# The start of an image body is read in chunks of this size until its header
+# is recognised
+IMAGE_HEADER_CHUNK_BYTES = 1 << 14
+
+# Priority order for sizes when downloading
+SIZE_PRIORITY = [
+    "Large HD", "Large", "Medium 800", "Medium 640",
+    "Medium", "OpenGraph", "TwitterCard", "Small 320", "Small"
+]
+
+# Position of each size in SIZE_PRIORITY; sizes not listed rank after all of them
+SIZE_RANK = {name: rank for rank, name in enumerate(SIZE_PRIORITY)}
+
+# File in the output directory where resolved image URLs are kept between runs
+URL_CACHE_FILE = 'urls_cache.json'
+
+# Maximum number of requests in flight to each Flickr host at once; other
+# hosts are not limited
+HOST_CONCURRENCY = {
+    'www.flickr.com': 4,
+    'live.staticflickr.com': 8,
+}
+
+# Seconds a cached Flickr DNS answer is reused before it is looked up again,
+# so long crawls still follow CDN address changes
+DNS_CACHE_TTL = 300
+
+_dns_cache = {}
+_system_getaddrinfo = socket.getaddrinfo
+# Number of open crawlers using the cache; socket.getaddrinfo is patched
+# while it is non-zero
+_dns_cache_users = 0
+_dns_cache_lock = threading.Lock()
+
+
+def _cached_getaddrinfo(host, port, *args, **kwargs):
+    """
+    Drop-in replacement for socket.getaddrinfo that memoizes Flickr lookups
+    for DNS_CACHE_TTL seconds.
+    
+    Lookups for any other host are passed through unchanged.
+    """
+    if not isinstance(host, str) or not host.endswith('flickr.com'):
+        return _system_getaddrinfo(host, port, *args, **kwargs)
+    
+    key = (host, port, args, tuple(sorted(kwargs.items())))
+    now = time.monotonic()
+    entry = _dns_cache.get(key)
+    if entry is None or entry[0] <= now:
+        result = _system_getaddrinfo(host, port, *args, **kwargs)
+        _dns_cache[key] = (now + DNS_CACHE_TTL, result)
+        return result
+    return entry[1]
+
+
+def install_dns_cache():
+    """
+    Route socket.getaddrinfo through the Flickr DNS cache and pre-resolve the
+    known Flickr hosts so that workers never block on a cold lookup.
+    
+    Calls are counted; only the first one patches socket.getaddrinfo and
+    pre-resolves, and each must be paired with uninstall_dns_cache.
+    """
+    global _dns_cache_users
+    with _dns_cache_lock:
+        _dns_cache_users += 1
+        if _dns_cache_users > 1:
+            return
+        socket.getaddrinfo = _cached_getaddrinfo
+    for host in FLICKR_HOSTS:
+        try:
+            socket.getaddrinfo(host, 443, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            logger.warning("Could not pre-resolve %s: %s", host, e)
+
+
+def uninstall_dns_cache():
+    """
+    Undo one install_dns_cache call, restoring the original
+    socket.getaddrinfo once no crawler uses the cache any more.
+    """
+    global _dns_cache_users
+    with _dns_cache_lock:
+        if _dns_cache_users == 0:
+            return
+        _dns_cache_users -= 1
+        if _dns_cache_users == 0:
+            if socket.getaddrinfo is _cached_getaddrinfo:
+                socket.getaddrinfo = _system_getaddrinfo
+            _dns_cache.clear()
+
+
+def _load_html_parser():
+    """
+    Pick and import the HTML parser used by parse_html.
+    
+    selectolax's C-backed Lexbor parser is preferred; otherwise BeautifulSoup
+    is used, with lxml as its parser when installed.
+    """
+    global _html_parse, _html_backend
+    try:
+        from selectolax.lexbor import LexborHTMLParser
+        _html_backend = 'selectolax'
+        _html_parse = LexborHTMLParser
+    except ImportError:
+        from bs4 import BeautifulSoup
+        try:
+            import lxml  # noqa: F401
+            parser = 'lxml'
+        except ImportError:
+            parser = 'html.parser'
+        _html_backend = 'bs4'
+        _html_parse = lambda markup: BeautifulSoup(markup, parser)
+
+
+def parse_html(markup):
+    """
+    Parse HTML, importing the parser on first use.
+    
+    Args:
+        markup: HTML text
+        
+    Returns:
+        Parsed tree, to be queried with select_nodes
+    """
+    if _html_parse is None:
+        _load_html_parser()
+    return _html_parse(markup)
+
+
+def select_nodes(tree, selector):
+    """
+    Run a CSS selector against a tree returned by parse_html.
+    
+    Args:
+        tree: Parsed HTML tree
+        selector: CSS selector
+        
+    Returns:
+        List of (text, attributes) tuples for the matching elements
+    """
+    if _html_backend == 'selectolax':
+        return [(node.text(deep=True), node.attributes) for node in tree.css(selector)]
+    return [(tag.get_text(), tag.attrs) for tag in tree.select(selector)]
+
+
+def select_attr(tree, selector, attr):
+    """
+    Get one attribute of the first element matching a CSS selector.
+    
+    The search stops at the first match instead of collecting every match
+    and building its text.
+    
+    Args:
+        tree: Parsed HTML tree
+        selector: CSS selector
+        attr: Attribute name
+        
+    Returns:
+        Attribute value, or None if nothing matches or it lacks the attribute
+    """
+    if _html_backend == 'selectolax':
+        node = tree.css_first(selector)
+        return node.attributes.get(attr) if node is not None else None
+    tag = tree.select_one(selector)
+    return tag.get(attr) if tag is not None else None
+
+
+def link_or_copy(src, dst):
+    """
+    Atomically make dst a hard link to src, copying if linking is not possible.
+    
+    Args:
+        src: Existing file
+        dst: Path to create or replace
+    """
+    tmp_dst = dst + '.part'
+    if os.path.exists(tmp_dst):
+        os.remove(tmp_dst)
+    try:
+        os.link(src, tmp_dst)
+    except OSError:
+        shutil.copyfile(src, tmp_dst)
+    os.replace(tmp_dst, dst)
+
+
+def ensure_url_scheme(url):
+    """
+    Ensure URL has a proper scheme (http/https).
+    
+    Args:
+        url: URL that might be protocol-relative
+        
+    Returns:
+        URL with proper scheme
+    """
+    if url.startswith(('http://', 'https://')):
+        return url
+    return ('https:' if url.startswith('//') else 'https://') + url
+
+
+def flickr_size_urls(server, photo_id, secret):
+    """
+    Build the URLs of the standard Flickr sizes of a photo.
+    
+    Args:
+        server: Flickr server ID
+        photo_id: Flickr photo ID
+        secret: Photo secret
+        
+    Returns:
+        Dictionary of size names to URLs
+    """
+    base_url = f"https://live.staticflickr.com/{server}/{photo_id}_{secret}"
+    available_sizes = {"Large HD": f"{base_url}_h_d.jpg"}
+    for name, suffix in SIZE_SUFFIXES.items():
+        available_sizes[name] = f"{base_url}{suffix}"
+    return available_sizes
+
+
+def size_rank(size_name):
+    """
+    Sort key ordering size names by SIZE_PRIORITY.
+    """
+    return SIZE_RANK.get(size_name, len(SIZE_RANK))
+
+
+class DownloadStatus(IntEnum):
+    """
+    Outcome of resolving or downloading a photo.
+    """
+    OK = 0
+    PRIVATE = 1
+    NOT_FOUND = 2
+    FAILED = 3
+
+
+# Crawl statistics counted on top of 'failed' for specific failure reasons
+FAILURE_COUNTERS = {DownloadStatus.PRIVATE: 'private', DownloadStatus.NOT_FOUND: 'not_found'}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the request rate to a single host.
+    """
+    
+    def __init__(self, rate, burst):
+        """
+        Args:
+            rate: Tokens added per second
+            burst: Maximum number of tokens that can accumulate
+        """
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.timestamp = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """
+        Take one token, sleeping until it is available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+            self.timestamp = now
+            # Reserve the token now and sleep outside the lock, so that
+            # waiting threads are served in order
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
 
 class PIPACrawler:
-    def __init__(self, data_file='all_data.txt', output_dir='pipa_images_highest_res', max_retries=3, delay=1):
+    def __init__(self, data_file='all_data.txt', output_dir='pipa_images_highest_res', max_retries=3, delay=1,
+                 num_workers=1, client='requests', refresh=False):
         """
         Initialize the PIPA crawler.
         
         Args:
             data_file: Path to the all_data.txt file containing image IDs
             output_dir: Directory to save downloaded images
-            max_retries: Maximum number of retries for failed downloads
-            delay: Delay between requests to avoid rate limiting
+            max_retries: Maximum number of retries for failed requests
+            delay: Average delay between page requests to www.flickr.com per
+                worker, used to rate limit each Flickr host independently (0
+                disables rate limiting)
+            num_workers: Expected number of parallel workers, used to size the
+                connection pool and to scale the rate limits; crawl() resizes
+                both for the number of workers it is given
+            client: HTTP client to use: 'requests' (HTTP/1.1 keep-alive pool) or
+                'httpx' (HTTP/2, multiplexes requests over one connection per host)
+            refresh: If True, images that already exist are revalidated with a
+                conditional request and downloaded again only if they changed
         """
         self.data_file = data_file
         self.output_dir = output_dir
         self.max_retries = max_retries
         self.delay = delay
+        self.client = client
+        self.refresh = refresh
         
         # Create output directory if it doesn't exist
         os.makedirs(output_dir, exist_ok=True)
@@ -41,22 +395,203 @@ class PIPACrawler:
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        
+        install_dns_cache()
+        self._dns_cache_installed = True
+        
+        # Shared session so keep-alive connections to flickr.com and
+        # staticflickr.com are reused across photos instead of re-handshaking
+        if client == 'httpx':
+            if httpx is None:
+                raise ImportError("The httpx client requires httpx with HTTP/2 support: pip install 'httpx[http2]'")
+            # httpx only retries failed connection attempts, not error statuses.
+            # Over HTTP/2 the workers' requests to a host share one connection
+            # as concurrent streams, so only a few connections are kept alive.
+            transport = httpx.HTTPTransport(
+                http2=True,
+                retries=max_retries,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            )
+            self.session = httpx.Client(
+                transport=transport,
+                headers=self.headers,
+                timeout=10.0,
+                follow_redirects=True
+            )
+        elif client == 'requests':
+            self.session = requests.Session()
+            self.session.headers.update(self.headers)
+            # Retries with exponential backoff happen inside urllib3; once they
+            # are used up the last response is returned rather than raised
+            self._retry = Retry(
+                total=max_retries,
+                backoff_factor=delay,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(['GET', 'HEAD']),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+        else:
+            raise ValueError(f"Unknown HTTP client: {client}")
+        
+        # Disk writes happen on a dedicated thread so that network workers can
+        # go back to fetching as soon as an image body has been received
+        self._disk_queue = queue.Queue(maxsize=64)
+        self._write_failures = []
+        self._write_failures_lock = threading.Lock()
+        self._disk_thread = threading.Thread(target=self._disk_writer, daemon=True)
+        self._disk_thread.start()
+        
+        self._num_workers = None
+        self._set_num_workers(num_workers)
+        
+        # Per-host caps on concurrent requests, independent of the number of
+        # workers
+        self._host_slots = {host: threading.BoundedSemaphore(limit) for host, limit in HOST_CONCURRENCY.items()}
+        
+        # Image URLs resolved for each photo ID, in this run or a previous one
+        self._url_cache_file = os.path.join(output_dir, URL_CACHE_FILE)
+        self._url_cache_lock = threading.Lock()
+        try:
+            with open(self._url_cache_file) as f:
+                self._url_cache = json.load(f)
+        except (OSError, ValueError):
+            self._url_cache = {}
+        # Photo IDs whose page was fetched in this run
+        self._fetched_photo_ids = set()
     
-    def _ensure_url_scheme(self, url):
+    def _set_num_workers(self, num_workers):
         """
-        Ensure URL has a proper scheme (http/https).
+        Size the connection pool and the per-host rate limits for a number of
+        parallel workers.
         
         Args:
-            url: URL that might be protocol-relative
+            num_workers: Number of parallel workers
+        """
+        num_workers = max(1, num_workers)
+        if num_workers == self._num_workers:
+            return
+        self._num_workers = num_workers
+        
+        if self.client == 'requests':
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max(32, num_workers * 4), max_retries=self._retry)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+        
+        # Per-host rate limits, so throttling the page host does not slow
+        # down image downloads from the CDN and vice versa. The rates grow
+        # with the number of workers, so each worker keeps the pace of a
+        # sequential crawl and adding workers still speeds the crawl up.
+        self._buckets = {}
+        if self.delay > 0:
+            self._buckets = {
+                'www.flickr.com': TokenBucket(rate=num_workers / self.delay, burst=max(8, 2 * num_workers)),
+                'live.staticflickr.com': TokenBucket(rate=4 * num_workers / self.delay, burst=max(16, 8 * num_workers)),
+            }
+    
+    def close(self):
+        """
+        Wait for pending image writes, stop the disk writer thread, save the
+        URL cache and close the pooled HTTP connections.
+        """
+        if self._disk_thread.is_alive():
+            self._disk_queue.put(None)
+            self._disk_thread.join()
+        self.save_url_cache()
+        self.session.close()
+        if self._dns_cache_installed:
+            self._dns_cache_installed = False
+            uninstall_dns_cache()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _host_slot(self, url):
+        """
+        Context manager holding one of the concurrent request slots of a host.
+        
+        Args:
+            url: URL about to be fetched
             
         Returns:
-            URL with proper scheme
+            Context manager; a no-op for hosts without a concurrency cap
         """
-        if url.startswith('//'):
-            return f"https:{url}"
-        elif not url.startswith(('http://', 'https://')):
-            return f"https://{url}"
-        return url
+        slot = self._host_slots.get(urlsplit(url).hostname)
+        return slot if slot is not None else contextlib.nullcontext()
+    
+    def _get(self, url, stream=False, headers=None):
+        """
+        Issue a GET through the shared session, honouring the per-host rate limit.
+        
+        Non-streamed requests also take a slot of the per-host concurrency cap.
+        Streamed requests must be made inside _host_slot by the caller, so that
+        the slot is held until the body has been read.
+        
+        Args:
+            url: URL to fetch
+            stream: If True, the body is not read until requested via _iter_body
+            headers: Optional extra request headers
+            
+        Returns:
+            requests.Response or httpx.Response, depending on the client
+        """
+        bucket = self._buckets.get(urlsplit(url).hostname)
+        if bucket is not None:
+            bucket.acquire()
+        if stream:
+            return self._send(url, True, headers)
+        with self._host_slot(url):
+            return self._send(url, False, headers)
+    
+    def _send(self, url, stream, headers):
+        """
+        Send a GET with whichever client the crawler was configured with.
+        """
+        if self.client == 'httpx':
+            return self.session.send(self.session.build_request('GET', url, headers=headers), stream=stream)
+        return self.session.get(url, timeout=10, stream=stream, headers=headers)
+    
+    def _iter_body(self, response, chunk_size):
+        """
+        Iterate over the decoded body of a streamed response.
+        
+        Args:
+            response: Response returned by _get(..., stream=True)
+            chunk_size: Size of the chunks to read
+            
+        Returns:
+            Iterator over bytes chunks
+        """
+        if self.client == 'httpx':
+            return response.iter_bytes(chunk_size)
+        return response.iter_content(chunk_size)
+    
+    def _release(self, response):
+        """
+        Stop reading a streamed response, keeping its connection when cheap.
+        
+        Over HTTP/2 closing the response only resets its stream. An HTTP/1.1
+        connection can only go back to the pool once the whole body has been
+        read, and closing it early closes the socket. So the rest of the body
+        is read and discarded only when Content-Length says fewer than
+        RELEASE_DRAIN_LIMIT bytes are left, as for small error pages. For
+        anything larger, or of unknown length, the bytes saved are worth more
+        than the new TCP+TLS handshake the next request to the host pays.
+        
+        Args:
+            response: Response returned by _get(..., stream=True)
+        """
+        if self.client == 'requests':
+            try:
+                remaining = int(response.headers['Content-Length']) - response.raw.tell()
+            except (KeyError, ValueError):
+                remaining = None
+            if remaining is not None and remaining < RELEASE_DRAIN_LIMIT:
+                response.raw.drain_conn()
+        response.close()
     
     def parse_image_ids(self, limit=None):
         """
@@ -68,15 +603,55 @@ class PIPACrawler:
         Returns:
             List of (index, image_id) tuples
         """
-        image_ids = []
-        with open(self.data_file, 'r') as f:
-            for i, line in enumerate(f):
-                if limit and i >= limit:
-                    break
-                parts = line.strip().split()
-                if len(parts) >= 2:
-                    image_ids.append((i, parts[1]))
-        return image_ids
+        with open(self.data_file, 'rb') as f:
+            lines = f.read().splitlines()
+        if limit:
+            lines = lines[:limit]
+        
+        # Only the first two columns are needed, so stop splitting after them
+        rows = (line.split(None, 2) for line in lines)
+        return [(i, parts[1].decode()) for i, parts in enumerate(rows) if len(parts) >= 2]
+    
+    def _scan_page(self, response, photo_id):
+        """
+        Read a streamed Flickr photo page until it shows an image URL of the photo.
+        
+        Scanning stops early, and the response is released with _release, in
+        two cases: IMAGE_URL_RE matches a staticflickr URL of this photo, or
+        PRIVATE_PAGE_MARKER shows up. Flickr does not show the image of a
+        private photo, so a page that shows it is public. An image URL of any
+        other photo is not trusted; private and login pages carry a generic
+        og:image too. Otherwise the whole page is read so the caller can check
+        it for the private marker and fall back to a full parse. The regexes
+        only look at the first HTML_SCAN_LIMIT bytes.
+        
+        Args:
+            response: Response returned by _get(..., stream=True)
+            photo_id: Flickr photo ID the page belongs to
+            
+        Returns:
+            Page bytes read
+        """
+        photo_id_bytes = str(photo_id).encode()
+        buf = bytearray()
+        body_chunks = self._iter_body(response, HTML_CHUNK_BYTES)
+        for chunk in body_chunks:
+            scan_from = max(0, len(buf) - HTML_SCAN_OVERLAP)
+            buf += chunk
+            if buf.find(PRIVATE_PAGE_MARKER, scan_from) != -1:
+                self._release(response)
+                return buf
+            for match in IMAGE_URL_RE.finditer(buf, scan_from):
+                static_match = STATIC_URL_RE.search(match.group(match.lastgroup))
+                if static_match and static_match.group(2) == photo_id_bytes:
+                    self._release(response)
+                    return buf
+            if len(buf) >= HTML_SCAN_LIMIT:
+                break
+        
+        for chunk in body_chunks:
+            buf += chunk
+        return buf
     
     def get_image_urls(self, photo_id):
         """
@@ -88,264 +663,587 @@ class PIPACrawler:
         Returns:
             Dictionary of available sizes with their URLs, or None if not found or private
         """
+        return self._resolve_image_urls(photo_id)[1]
+    
+    def _resolve_image_urls(self, photo_id):
+        """
+        Like get_image_urls, but also reports why no URLs were found.
+        
+        Photos resolved before, in this run or one saved to URL_CACHE_FILE,
+        are answered from the cache without a request.
+        
+        Args:
+            photo_id: Flickr photo ID
+            
+        Returns:
+            Tuple of (DownloadStatus, dictionary of available sizes or None)
+        """
+        key = str(photo_id)
+        with self._url_cache_lock:
+            cached = self._url_cache.get(key)
+        if cached is not None:
+            return DownloadStatus.OK, cached
+        
+        status, available_sizes = self._fetch_image_urls(photo_id)
+        with self._url_cache_lock:
+            self._fetched_photo_ids.add(key)
+            if status == DownloadStatus.OK:
+                self._url_cache[key] = available_sizes
+        return status, available_sizes
+    
+    def _forget_image_urls(self, photo_id, available_urls):
+        """
+        Drop the cached URLs of a photo after none of them could be downloaded.
+        
+        Args:
+            photo_id: Flickr photo ID
+            available_urls: URLs that failed
+            
+        Returns:
+            True if the failed URLs came from an earlier run's cache, so that
+            fetching the photo page again may give different ones
+        """
+        key = str(photo_id)
+        with self._url_cache_lock:
+            if self._url_cache.get(key) != available_urls:
+                return False
+            del self._url_cache[key]
+            return key not in self._fetched_photo_ids
+    
+    def _fetch_image_urls(self, photo_id):
+        """
+        Scrape the Flickr page of a photo for its image URLs.
+        
+        Args:
+            photo_id: Flickr photo ID
+            
+        Returns:
+            Tuple of (DownloadStatus, dictionary of available sizes or None)
+        """
         flickr_url = f"https://www.flickr.com/photo.gne?id={photo_id}"
         
-        for attempt in range(self.max_retries):
-            try:
-                # First check if the photo exists and is public
-                response = requests.get(flickr_url, headers=self.headers, timeout=10)
-                
-                # Check if the page was found
+        try:
+            # First check if the photo exists and is public. Fast path: stop
+            # reading the page as soon as an image URL of the photo shows up
+            # in the raw bytes
+            with self._host_slot(flickr_url):
+                response = self._get(flickr_url, stream=True)
                 if response.status_code == 200:
-                    if "This photo is private" in response.text:
-                        print(f"  Photo {photo_id} is private")
-                        return None
-                    
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    available_sizes = {}
-                    
-                    # Method 1: Try to extract image URLs directly from the page
-                    # Look for the largest available size in the page
-                    for img in soup.select('img[src*="staticflickr"]'):
-                        if 'src' in img.attrs:
-                            src = img['src']
-                            # Try to get the base URL without size suffix
-                            base_url = src
-                            for suffix in ['_m', '_n', '_s', '_t', '_q', '_sq']:
-                                if suffix in base_url:
-                                    base_url = base_url.rsplit(suffix, 1)[0]
-                                    break
+                    body = self._scan_page(response, photo_id)
+                else:
+                    self._release(response)
+            
+            # Check if the page was found
+            if response.status_code == 200:
+                if PRIVATE_PAGE_MARKER in body:
+                    logger.info("Photo %s is private", photo_id)
+                    return DownloadStatus.PRIVATE, None
+                
+                # Any staticflickr URL of this photo on the page gives its
+                # server and secret, from which every size can be built
+                # without parsing the page
+                photo_id_bytes = str(photo_id).encode()
+                for static_match in STATIC_URL_RE.finditer(body):
+                    if static_match.group(2) == photo_id_bytes:
+                        server, secret = static_match.group(1).decode(), static_match.group(3).decode()
+                        return DownloadStatus.OK, flickr_size_urls(server, photo_id, secret)
+                
+                # Slow path: parse the whole page
+                available_sizes = {}
+                html = body.decode(response.encoding or 'utf-8', errors='replace')
+                tree = parse_html(html)
+                
+                # Method 1: Try to extract image URLs directly from the page.
+                # A staticflickr image URL of this photo without its size
+                # suffix and extension gives the base for every standard size.
+                # URLs of other photos on the page (thumbnails of related
+                # photos) are skipped.
+                for base_match in FLICKR_BASE_RE.finditer(html):
+                    if base_match.group(2) == str(photo_id):
+                        base_url = ensure_url_scheme(base_match.group(1))
+                        available_sizes.update({name: f"{base_url}{suffix}" for name, suffix in SIZE_SUFFIXES.items()})
+                        break
+                
+                # Method 2: Try to find the "View all sizes" link and follow it
+                if not available_sizes:
+                    sizes_link = select_attr(tree, 'a[href*="/sizes/"]', 'href')
+                    if sizes_link:
+                        sizes_url = urljoin("https://www.flickr.com", sizes_link)
+                        sizes_response = self._get(sizes_url)
+                        
+                        if sizes_response.status_code == 200:
+                            sizes_tree = parse_html(sizes_response.text)
                             
-                            # If we found a base URL, try to construct URLs for different sizes
-                            if base_url:
-                                # Remove file extension if present
-                                if '.' in base_url:
-                                    base_url = base_url.rsplit('.', 1)[0]
-                                
-                                # Try different size suffixes
-                                suffixes = {
-                                    "_b.jpg": "Large",
-                                    "_c.jpg": "Medium 800",
-                                    "_z.jpg": "Medium 640",
-                                    ".jpg": "Medium",
-                                    "_n.jpg": "Small 320",
-                                    "_m.jpg": "Small"
-                                }
-                                
-                                for suffix, name in suffixes.items():
-                                    size_url = f"{base_url}{suffix}"
-                                    available_sizes[name] = self._ensure_url_scheme(size_url)
-                    
-                    # Method 2: Try to find the "View all sizes" link and follow it
-                    if not available_sizes:
-                        sizes_links = soup.select('a[href*="/sizes/"]')
-                        if sizes_links:
-                            sizes_url = urljoin("https://www.flickr.com", sizes_links[0]['href'])
-                            sizes_response = requests.get(sizes_url, headers=self.headers, timeout=10)
+                            # Look for all available size links
+                            size_options = [
+                                (size_text.strip(), urljoin("https://www.flickr.com", size_attrs['href']))
+                                for size_text, size_attrs in select_nodes(sizes_tree, 'ol.sizes-list li a')
+                                if size_attrs.get('href')
+                            ]
                             
-                            if sizes_response.status_code == 200:
-                                sizes_soup = BeautifulSoup(sizes_response.text, 'html.parser')
-                                
-                                # Look for all available size links
-                                size_options = sizes_soup.select('ol.sizes-list li a')
-                                for size_link in size_options:
-                                    size_name = size_link.text.strip()
-                                    size_href = size_link['href']
-                                    
-                                    # Follow the link to get the actual image URL
-                                    size_page_url = urljoin("https://www.flickr.com", size_href)
-                                    size_page_response = requests.get(size_page_url, headers=self.headers, timeout=10)
-                                    
-                                    if size_page_response.status_code == 200:
-                                        size_page_soup = BeautifulSoup(size_page_response.text, 'html.parser')
-                                        img = size_page_soup.select_one('img#allsizes-photo')
-                                        if img and 'src' in img.attrs:
-                                            available_sizes[size_name] = self._ensure_url_scheme(img['src'])
-                    
-                    # Method 3: Try to extract from OpenGraph or Twitter card meta tags
-                    if not available_sizes:
-                        # Look for image in OpenGraph meta tags
-                        og_image = soup.select_one('meta[property="og:image"]')
-                        if og_image and 'content' in og_image.attrs:
-                            url = og_image['content']
-                            available_sizes["OpenGraph"] = self._ensure_url_scheme(url)
-                        
-                        # Look for image in Twitter card
-                        twitter_image = soup.select_one('meta[name="twitter:image"]')
-                        if twitter_image and 'content' in twitter_image.attrs:
-                            url = twitter_image['content']
-                            available_sizes["TwitterCard"] = self._ensure_url_scheme(url)
-                    
-                    # Method 4: Try to use the example URLs provided by the user
-                    # Extract server and secret from any available URL
-                    server = None
-                    secret = None
-                    
-                    for url in available_sizes.values():
-                        parsed_url = urlparse(url)
-                        path_parts = parsed_url.path.split('/')
-                        if len(path_parts) >= 3:
-                            server = path_parts[1]
-                            filename = path_parts[-1]
-                            parts = filename.split('_')
-                            if len(parts) >= 2:
-                                secret = parts[1].split('.')[0]
-                                break
-                    
-                    # If we found server and secret, try to construct high-res URLs
-                    if server and secret:
-                        # Try the URL patterns from the user's example
-                        large_url = f"https://live.staticflickr.com/{server}/{photo_id}_{secret}_h_d.jpg"
-                        available_sizes["Large HD"] = large_url
-                        
-                        # Don't add original URL as it requires authentication
-                        # original_url = f"https://live.staticflickr.com/{server}/{photo_id}_{secret}_o_d.jpg"
-                        # available_sizes["Original"] = original_url
+                            # Follow the links to get the actual image URLs; the
+                            # size pages are independent, so fetch them at once
+                            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(size_options))) as executor:
+                                size_page_responses = list(executor.map(self._get, [url for _, url in size_options]))
+                            
+                            for (size_name, _), size_page_response in zip(size_options, size_page_responses):
+                                if size_page_response.status_code == 200:
+                                    size_page_tree = parse_html(size_page_response.text)
+                                    src = select_attr(size_page_tree, 'img#allsizes-photo', 'src')
+                                    if src:
+                                        available_sizes[size_name] = ensure_url_scheme(src)
+                
+                # Method 3: Try to extract from OpenGraph or Twitter card meta tags
+                if not available_sizes:
+                    # Look for image in OpenGraph meta tags
+                    url = select_attr(tree, 'meta[property="og:image"]', 'content')
+                    if url:
+                        available_sizes["OpenGraph"] = ensure_url_scheme(url)
                     
-                    if available_sizes:
-                        return available_sizes
-                    else:
-                        print(f"  Could not find any image URLs for photo {photo_id}")
-                        return None
+                    # Look for image in Twitter card
+                    url = select_attr(tree, 'meta[name="twitter:image"]', 'content')
+                    if url:
+                        available_sizes["TwitterCard"] = ensure_url_scheme(url)
                 
-                elif response.status_code == 404:
-                    print(f"  Photo {photo_id} not found (404)")
-                    return None
+                # Method 4: Try to use the example URLs provided by the user
+                # Extract server and secret from any available URL
+                server = None
+                secret = None
                 
+                for url in available_sizes.values():
+                    static_match = STATIC_URL_TEXT_RE.search(url)
+                    if static_match:
+                        server, secret = static_match.group(1), static_match.group(3)
+                        break
+                
+                # If we found server and secret, try to construct high-res URLs
+                if server and secret:
+                    # Try the URL patterns from the user's example
+                    large_url = f"https://live.staticflickr.com/{server}/{photo_id}_{secret}_h_d.jpg"
+                    available_sizes["Large HD"] = large_url
+                    
+                    # Don't add original URL as it requires authentication
+                    # original_url = f"https://live.staticflickr.com/{server}/{photo_id}_{secret}_o_d.jpg"
+                    # available_sizes["Original"] = original_url
+                
+                if available_sizes:
+                    return DownloadStatus.OK, available_sizes
                 else:
-                    print(f"  Unexpected status code {response.status_code} for photo {photo_id}, retrying...")
-                    time.sleep(self.delay * (attempt + 1))
+                    logger.info("Could not find any image URLs for photo %s", photo_id)
+                    return DownloadStatus.FAILED, None
             
-            except Exception as e:
-                print(f"  Error accessing photo {photo_id}: {str(e)}, retrying...")
-                time.sleep(self.delay * (attempt + 1))
+            elif response.status_code == 404:
+                logger.info("Photo %s not found (404)", photo_id)
+                return DownloadStatus.NOT_FOUND, None
+            
+            else:
+                logger.warning("Failed to access photo %s, status code: %s", photo_id, response.status_code)
         
-        print(f"  Failed to access photo {photo_id} after {self.max_retries} attempts")
-        return None
+        except Exception as e:
+            logger.warning("Error accessing photo %s: %s", photo_id, e)
+        
+        return DownloadStatus.FAILED, None
     
-    def download_image(self, idx, photo_id):
+    def _read_image(self, response):
+        """
+        Read the body of a streamed image response and identify the image.
+        
+        The image header is parsed from the first IMAGE_HEADER_CHUNK_BYTES
+        chunks as they arrive, so usually no second pass over the bytes is
+        needed to get the resolution. Once the header is known, the rest of
+        the body is read in one call. If the incremental parser never
+        recognises the header, the whole body is opened with Image.open, so
+        anything PIL can open is accepted.
+        
+        Args:
+            response: Response returned by _get(..., stream=True)
+            
+        Returns:
+            Tuple of (body bytes, (width, height) or None if not a valid image)
+        """
+        parser = ImageFile.Parser()
+        chunks = []
+        size = None
+        body = self._iter_body(response, IMAGE_HEADER_CHUNK_BYTES)
+        for chunk in body:
+            chunks.append(chunk)
+            parser.feed(chunk)
+            if parser.image is not None:
+                size = parser.image.size
+                if self.client == 'httpx':
+                    # httpx cannot read() a stream that has been iterated, so
+                    # the rest comes from the same iterator
+                    chunks.extend(body)
+                else:
+                    chunks.append(response.raw.read(decode_content=True))
+                break
+        
+        data = b''.join(chunks)
+        if size is None and data:
+            try:
+                with Image.open(io.BytesIO(data)) as img:
+                    size = img.size
+            except Exception:
+                pass
+        return data, size
+    
+    def _disk_writer(self):
+        """
+        Write queued (filename, bytes, alias filenames, meta) items to disk, forever.
+        
+        Each image is written to a ".part" file first and renamed into place,
+        so a file only becomes visible under its final name once complete.
+        The alias file names then get a hard link to the same data (or a copy
+        where the file system does not support links). Every file gets a
+        ".meta" sidecar holding the meta dictionary as JSON. File names that
+        could not be written are collected for take_write_failures. A None
+        item, queued by close(), stops the thread.
+        """
+        while True:
+            item = self._disk_queue.get()
+            if item is None:
+                self._disk_queue.task_done()
+                return
+            filename, data, alias_filenames, meta = item
+            try:
+                written, failed = self._write_image(filename, data, alias_filenames)
+                meta_data = json.dumps(meta)
+                for meta_filename in written:
+                    try:
+                        with open(meta_filename + '.meta', 'w') as f:
+                            f.write(meta_data)
+                    except OSError as e:
+                        # The sidecar is only a shortcut; the image is still there
+                        logger.warning("Error writing %s.meta: %s", meta_filename, e)
+                if failed:
+                    with self._write_failures_lock:
+                        self._write_failures.extend(failed)
+            finally:
+                self._disk_queue.task_done()
+    
+    def _write_image(self, filename, data, alias_filenames):
+        """
+        Write one image and its aliases, as described in _disk_writer.
+        
+        Returns:
+            Tuple of (file names written, file names that could not be written)
+        """
+        tmp_filename = filename + '.part'
+        try:
+            with open(tmp_filename, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_filename, filename)
+        except OSError as e:
+            logger.error("Error writing %s: %s", filename, e)
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            return [], [filename, *alias_filenames]
+        
+        written, failed = [filename], []
+        for alias_filename in alias_filenames:
+            try:
+                link_or_copy(filename, alias_filename)
+                written.append(alias_filename)
+            except OSError as e:
+                logger.error("Error writing %s: %s", alias_filename, e)
+                failed.append(alias_filename)
+        return written, failed
+    
+    def _read_meta(self, filename):
+        """
+        Read the ".meta" sidecar written next to a downloaded image.
+        
+        Args:
+            filename: Path of the image
+            
+        Returns:
+            Meta dictionary, or None if the sidecar is missing or unreadable
+        """
+        try:
+            with open(filename + '.meta') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def flush(self):
+        """
+        Block until every image handed to the disk writer has been written.
+        
+        Images that could not be written are reported by take_write_failures.
+        """
+        self._disk_queue.join()
+    
+    def take_write_failures(self):
+        """
+        Get and clear the file names the disk writer failed to write.
+        
+        Call after flush() to account for every image handed to the writer.
+        
+        Returns:
+            List of image file names
+        """
+        with self._write_failures_lock:
+            failed, self._write_failures = self._write_failures, []
+        return failed
+    
+    def save_url_cache(self):
+        """
+        Write the resolved image URLs to URL_CACHE_FILE in the output directory,
+        so the next run does not fetch the Flickr pages of these photos again.
+        """
+        with self._url_cache_lock:
+            data = json.dumps(self._url_cache)
+        tmp_filename = self._url_cache_file + '.part'
+        try:
+            with open(tmp_filename, 'w') as f:
+                f.write(data)
+            os.replace(tmp_filename, self._url_cache_file)
+        except OSError as e:
+            logger.error("Error writing %s: %s", self._url_cache_file, e)
+    
+    def download_image(self, idx, photo_id, existing_files=None, available_urls=None, aliases=()):
         """
         Download an image given its photo ID.
         
+        The image is written to disk by a background thread, so the file may
+        not exist yet when this returns. Call flush() before using it, then
+        take_write_failures() to find images whose write failed.
+        
         Args:
             idx: Index of the image in the dataset
             photo_id: Flickr photo ID
+            existing_files: Optional set of file names already present in the
+                output directory; avoids a stat() per image when given
+            available_urls: Optional result of get_image_urls for this photo, if
+                it has already been resolved
+            aliases: Indices of other rows showing the same photo; once the
+                image is written it is hard-linked to their file names too
             
         Returns:
-            Tuple of (success, filename or error message, resolution)
+            Tuple of (DownloadStatus, filename or error message, resolution)
         """
-        filename = os.path.join(self.output_dir, f'{idx:05d}.jpg')
+        name = f'{idx:05d}.jpg'
+        filename = os.path.join(self.output_dir, name)
         
         # Skip if already downloaded
-        if os.path.exists(filename):
-            try:
-                with Image.open(filename) as img:
-                    width, height = img.size
-                    print(f"  Image {filename} already exists, size: {width}x{height}")
-                    return True, filename, (width, height)
-            except Exception:
-                print(f"  Image {filename} exists but could not be opened, will redownload")
-        
-        print(f"Processing photo ID: {photo_id}")
+        if existing_files is None:
+            already_downloaded = os.path.exists(filename)
+        else:
+            already_downloaded = name in existing_files
+        # Validators of the existing image when it is being revalidated
+        cached_meta = None
+        if already_downloaded:
+            # The sidecar saves opening the image to read its header
+            meta = self._read_meta(filename)
+            if meta is not None and self.refresh and meta.get('url'):
+                cached_meta = meta
+                available_urls = {"Cached": meta['url']}
+            elif meta is not None:
+                width, height = meta['width'], meta['height']
+                logger.info("Image %s already exists, size: %dx%d", filename, width, height)
+                return DownloadStatus.OK, filename, (width, height)
+            else:
+                try:
+                    with Image.open(filename) as img:
+                        width, height = img.size
+                        logger.info("Image %s already exists, size: %dx%d", filename, width, height)
+                        return DownloadStatus.OK, filename, (width, height)
+                except Exception:
+                    logger.warning("Image %s exists but could not be opened, will redownload", filename)
         
         # Try to get all available image URLs
-        available_urls = self.get_image_urls(photo_id)
+        if available_urls is None:
+            logger.debug("Processing photo ID: %s", photo_id)
+            status, available_urls = self._resolve_image_urls(photo_id)
+            if status != DownloadStatus.OK:
+                return status, "Could not find any image URLs", (0, 0)
         
         if not available_urls:
-            return False, "Could not find any image URLs", (0, 0)
+            return DownloadStatus.FAILED, "Could not find any image URLs", (0, 0)
         
-        # Priority order for sizes
-        size_priority = [
-            "Large HD", "Large", "Medium 800", "Medium 640", 
-            "Medium", "OpenGraph", "TwitterCard", "Small 320", "Small"
-        ]
+        alias_filenames = [os.path.join(self.output_dir, f'{alias:05d}.jpg') for alias in aliases]
         
-        # Try downloading in priority order
-        for size_name in size_priority:
-            if size_name in available_urls:
-                url = available_urls[size_name]
-                print(f"  Trying URL ({size_name}): {url}")
+        outcome = self._download_urls(filename, available_urls, alias_filenames, cached_meta)
+        if outcome is None and cached_meta is None and self._forget_image_urls(photo_id, available_urls):
+            # The URLs were resolved in an earlier run and may be stale, e.g.
+            # because the photo was replaced; look the photo up once more
+            logger.info("Cached URLs of photo %s failed, resolving it again", photo_id)
+            status, available_urls = self._resolve_image_urls(photo_id)
+            if status != DownloadStatus.OK:
+                return status, "Could not find any image URLs", (0, 0)
+            outcome = self._download_urls(filename, available_urls, alias_filenames, cached_meta)
+            if outcome is None:
+                self._forget_image_urls(photo_id, available_urls)
+        if outcome is not None:
+            return outcome
+        
+        if cached_meta is not None:
+            width, height = cached_meta['width'], cached_meta['height']
+            logger.warning("Could not revalidate %s, keeping it, size: %dx%d", filename, width, height)
+            return DownloadStatus.OK, filename, (width, height)
+        
+        logger.warning("Failed to download photo %s after trying all available URLs", photo_id)
+        return DownloadStatus.FAILED, "Failed to download after trying all available URLs", (0, 0)
+    
+    def _download_urls(self, filename, available_urls, alias_filenames, cached_meta):
+        """
+        Download an image from the first of its URLs that works.
+        
+        Args:
+            filename: Path to save the image to
+            available_urls: Dictionary of size names to URLs
+            alias_filenames: Paths to hard-link the image to once written
+            cached_meta: Meta of the existing image when it is being
+                revalidated, or None
+            
+        Returns:
+            Tuple as returned by download_image, or None if every URL failed
+        """
+        # Conditional request headers; the server answers 304 without a body
+        # if the image has not changed since it was downloaded
+        conditional_headers = None
+        if cached_meta is not None:
+            conditional_headers = {}
+            if cached_meta.get('etag'):
+                conditional_headers['If-None-Match'] = cached_meta['etag']
+            if cached_meta.get('last_modified'):
+                conditional_headers['If-Modified-Since'] = cached_meta['last_modified']
+        
+        # Try downloading in priority order, then any remaining sizes
+        ordered = sorted(available_urls.items(), key=lambda item: size_rank(item[0]))
+        
+        for size_name, url in ordered:
+            logger.debug("Trying URL (%s): %s", size_name, url)
+            
+            try:
+                with self._host_slot(url):
+                    response = self._get(url, stream=True, headers=conditional_headers)
+                    if response.status_code == 200:
+                        body, size = self._read_image(response)
+                    else:
+                        # Error bodies are small; reading them keeps the
+                        # connection reusable for the next size
+                        self._release(response)
                 
-                for attempt in range(self.max_retries):
-                    try:
-                        response = requests.get(url, headers=self.headers, timeout=10, stream=True)
-                        
-                        if response.status_code == 200:
-                            with open(filename, 'wb') as f:
-                                for chunk in response.iter_content(chunk_size=8192):
-                                    f.write(chunk)
-                            
-                            # Verify the image was downloaded correctly
-                            if os.path.getsize(filename) > 0:
-                                try:
-                                    with Image.open(filename) as img:
-                                        width, height = img.size
-                                        print(f"  Successfully downloaded {filename}, size: {width}x{height}")
-                                        return True, filename, (width, height)
-                                except Exception as e:
-                                    os.remove(filename)
-                                    print(f"  Downloaded file is not a valid image: {str(e)}")
-                            else:
-                                os.remove(filename)
-                                print(f"  Downloaded empty file")
-                        
-                        elif response.status_code == 410:
-                            # 410 Gone - This URL is no longer available, try next size
-                            print(f"  URL returned 410 Gone, trying next size")
-                            break
-                        
-                        else:
-                            print(f"  Failed to download image, status code: {response.status_code}, retrying...")
-                        
-                        time.sleep(self.delay * (attempt + 1))
-                    
-                    except Exception as e:
-                        print(f"  Error downloading image: {str(e)}, retrying...")
-                        time.sleep(self.delay * (attempt + 1))
+                if response.status_code == 200:
+                    # Verify the image was downloaded correctly before
+                    # handing it to the disk writer
+                    if not body:
+                        logger.debug("Downloaded empty file from %s", url)
+                    elif size is None:
+                        logger.debug("Downloaded file from %s is not a valid image", url)
+                    else:
+                        width, height = size
+                        meta = {
+                            'width': width,
+                            'height': height,
+                            'url': url,
+                            'etag': response.headers.get('ETag'),
+                            'last_modified': response.headers.get('Last-Modified'),
+                        }
+                        self._disk_queue.put((filename, body, alias_filenames, meta))
+                        logger.info("Successfully downloaded %s, size: %dx%d", filename, width, height)
+                        return DownloadStatus.OK, filename, (width, height)
+                
+                elif response.status_code == 304:
+                    width, height = cached_meta['width'], cached_meta['height']
+                    logger.info("Image %s not modified, size: %dx%d", filename, width, height)
+                    return DownloadStatus.OK, filename, (width, height)
+                
+                elif response.status_code == 410:
+                    # 410 Gone - This URL is no longer available, try next size
+                    logger.debug("%s returned 410 Gone, trying next size", url)
+                
+                else:
+                    logger.debug("Failed to download %s, status code: %s, trying next size", url, response.status_code)
+            
+            except Exception as e:
+                logger.debug("Error downloading %s: %s, trying next size", url, e)
+        
+        return None
+    
+    def _run_pool(self, func, items, num_workers):
+        """
+        Run func over items on a thread pool, yielding results as they complete.
         
-        # If we've tried all sizes and none worked, try any remaining URLs
-        for name, url in available_urls.items():
-            if name not in size_priority:
-                print(f"  Trying URL ({name}): {url}")
+        Only a bounded window of calls is in flight at any time, so the number
+        of pending futures does not grow with the size of the dataset. With
+        num_workers=1 the calls run one at a time in order.
+        
+        Args:
+            func: Callable taking one (idx, photo_id) item
+            items: Iterable of (idx, photo_id) items
+            num_workers: Number of worker threads
+            
+        Yields:
+            Tuples of (item, result, error) where error is the exception raised
+            by func, or None on success
+        """
+        max_in_flight = num_workers * 2
+        pending = iter(items)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            future_to_item = {}
+            while True:
+                for item in itertools.islice(pending, max_in_flight - len(future_to_item)):
+                    future_to_item[executor.submit(func, item)] = item
+                if not future_to_item:
+                    break
                 
-                for attempt in range(self.max_retries):
+                done, _ = concurrent.futures.wait(future_to_item, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    item = future_to_item.pop(future)
                     try:
-                        response = requests.get(url, headers=self.headers, timeout=10, stream=True)
-                        
-                        if response.status_code == 200:
-                            with open(filename, 'wb') as f:
-                                for chunk in response.iter_content(chunk_size=8192):
-                                    f.write(chunk)
-                            
-                            # Verify the image was downloaded correctly
-                            if os.path.getsize(filename) > 0:
-                                try:
-                                    with Image.open(filename) as img:
-                                        width, height = img.size
-                                        print(f"  Successfully downloaded {filename}, size: {width}x{height}")
-                                        return True, filename, (width, height)
-                                except Exception as e:
-                                    os.remove(filename)
-                                    print(f"  Downloaded file is not a valid image: {str(e)}")
-                            else:
-                                os.remove(filename)
-                                print(f"  Downloaded empty file")
-                        
-                        elif response.status_code == 410:
-                            # 410 Gone - This URL is no longer available, try next size
-                            print(f"  URL returned 410 Gone, trying next size")
-                            break
-                        
-                        else:
-                            print(f"  Failed to download image, status code: {response.status_code}, retrying...")
-                        
-                        time.sleep(self.delay * (attempt + 1))
-                    
+                        yield item, future.result(), None
                     except Exception as e:
-                        print(f"  Error downloading image: {str(e)}, retrying...")
-                        time.sleep(self.delay * (attempt + 1))
+                        yield item, None, e
+    
+    def _download_worker(self, download_queue, existing_files, results, results_lock):
+        """
+        Download photos taken from the crawl's download queue until a shutdown
+        sentinel is received.
         
-        return False, f"Failed to download after trying all available URLs", (0, 0)
+        Args:
+            download_queue: Queue of (idx, photo_id, available_urls, aliases)
+                items; a None item stops the worker
+            existing_files: Set of file names already present in the output directory
+            results: Statistics dictionary built by crawl
+            results_lock: Lock guarding results
+        """
+        while True:
+            item = download_queue.get()
+            if item is None:
+                return
+            idx, photo_id, available_urls, aliases = item
+            try:
+                outcome = self.download_image(idx, photo_id, existing_files, available_urls, aliases)
+            except Exception as e:
+                logger.error("Error processing %s: %s", photo_id, e)
+                with results_lock:
+                    results['failed'] += 1 + len(aliases)
+                continue
+            with results_lock:
+                for row_idx in (idx, *aliases):
+                    self._record_result(results, row_idx, photo_id, outcome)
+    
+    def _record_result(self, results, idx, photo_id, outcome):
+        """
+        Add the outcome of one download_image call to the crawl statistics.
+        
+        Args:
+            results: Statistics dictionary built by crawl
+            idx: Index of the image in the dataset
+            photo_id: Flickr photo ID
+            outcome: Tuple returned by download_image
+        """
+        status, _, resolution = outcome
+        if status == DownloadStatus.OK:
+            results['success'] += 1
+            results['resolutions'][idx] = (photo_id, resolution)
+        else:
+            results['failed'] += 1
+            counter = FAILURE_COUNTERS.get(status)
+            if counter is not None:
+                results[counter] += 1
     
     def crawl(self, limit=None, num_workers=1):
         """
@@ -353,67 +1251,97 @@ class PIPACrawler:
         
         Args:
             limit: Optional limit on the number of images to download
-            num_workers: Number of parallel workers for downloading
+            num_workers: Number of parallel workers for resolving image URLs,
+                and again for downloading; values below 1 crawl sequentially
             
         Returns:
             Dictionary with statistics about the crawl
         """
+        num_workers = max(1, num_workers)
+        self._set_num_workers(num_workers)
         image_ids = self.parse_image_ids(limit)
+        
+        # One directory scan instead of a stat() per image when resuming
+        existing_files = {entry.name for entry in os.scandir(self.output_dir) if entry.name.endswith('.jpg')}
         total = len(image_ids)
         
-        print(f"Found {total} image IDs to process")
+        logger.info("Found %d image IDs to process", total)
         
+        # Resolutions are stored in a slot per dataset index while the crawl
+        # runs, and turned into a list in dataset order at the end
         results = {
             'total': total,
             'success': 0,
             'failed': 0,
             'private': 0,
             'not_found': 0,
-            'resolutions': []
+            'resolutions': [None] * (image_ids[-1][0] + 1 if image_ids else 0)
         }
         
-        if num_workers > 1:
-            # Parallel download
-            with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-                future_to_id = {executor.submit(self.download_image, idx, photo_id): (idx, photo_id) 
-                               for idx, photo_id in image_ids}
-                
-                for future in concurrent.futures.as_completed(future_to_id):
-                    idx, photo_id = future_to_id[future]
-                    try:
-                        success, result, resolution = future.result()
-                        if success:
-                            results['success'] += 1
-                            results['resolutions'].append((idx, photo_id, resolution))
-                        else:
-                            results['failed'] += 1
-                            if "private" in result.lower():
-                                results['private'] += 1
-                            elif "not found" in result.lower():
-                                results['not_found'] += 1
-                    except Exception as e:
-                        print(f"  Error processing {photo_id}: {str(e)}")
-                        results['failed'] += 1
-        else:
-            # Sequential download
-            for idx, photo_id in image_ids:
-                try:
-                    success, result, resolution = self.download_image(idx, photo_id)
-                    if success:
-                        results['success'] += 1
-                        results['resolutions'].append((idx, photo_id, resolution))
-                    else:
-                        results['failed'] += 1
-                        if "private" in str(result).lower():
-                            results['private'] += 1
-                        elif "not found" in str(result).lower():
-                            results['not_found'] += 1
-                except Exception as e:
-                    print(f"  Error processing {photo_id}: {str(e)}")
-                    results['failed'] += 1
-                
-                # Add delay between requests
-                time.sleep(self.delay)
+        # Resolving image URLs (photo pages on www.flickr.com) and downloading
+        # the images (from the CDN) run as two thread pools connected by a
+        # bounded FIFO queue, so neither stage waits for the other to finish.
+        download_queue = queue.Queue(maxsize=4 * num_workers)
+        results_lock = threading.Lock()
+        downloaders = [
+            threading.Thread(target=self._download_worker,
+                             args=(download_queue, existing_files, results, results_lock), daemon=True)
+            for _ in range(num_workers)
+        ]
+        for thread in downloaders:
+            thread.start()
+        
+        # PIPA has one row per annotated person, so many rows share a photo.
+        # Rows already on disk skip the resolver stage; the missing rows of
+        # each photo are resolved and downloaded once, and the first row's
+        # file is hard-linked to the others. With refresh, the rows on disk
+        # are grouped by photo as well, so each photo is revalidated once.
+        missing_by_photo = {}
+        existing_by_photo = {}
+        for idx, photo_id in image_ids:
+            if f'{idx:05d}.jpg' not in existing_files:
+                missing_by_photo.setdefault(photo_id, []).append(idx)
+            elif self.refresh:
+                existing_by_photo.setdefault(photo_id, []).append(idx)
+            else:
+                download_queue.put((idx, photo_id, None, ()))
+        for photo_id, indices in existing_by_photo.items():
+            download_queue.put((indices[0], photo_id, None, tuple(indices[1:])))
+        to_resolve = [(indices[0], photo_id) for photo_id, indices in missing_by_photo.items()]
+        
+        resolve = lambda item: self._resolve_image_urls(item[1])
+        for (idx, photo_id), outcome, error in self._run_pool(resolve, to_resolve, num_workers):
+            aliases = tuple(missing_by_photo[photo_id][1:])
+            if error is not None:
+                logger.warning("Error resolving %s: %s", photo_id, error)
+                outcome = (DownloadStatus.FAILED, None)
+            status, available_urls = outcome
+            if status != DownloadStatus.OK:
+                # Nothing to download; report every row of the photo right away
+                with results_lock:
+                    for row_idx in (idx, *aliases):
+                        self._record_result(results, row_idx, photo_id,
+                                            (status, "Could not find any image URLs", (0, 0)))
+                continue
+            download_queue.put((idx, photo_id, available_urls, aliases))
+        
+        # One shutdown sentinel per downloader, after every real item
+        for _ in downloaders:
+            download_queue.put(None)
+        for thread in downloaders:
+            thread.join()
+        self.flush()
+        self.save_url_cache()
+        
+        # Downloads whose file could not be written were counted as successes
+        for failed_filename in self.take_write_failures():
+            idx = int(os.path.splitext(os.path.basename(failed_filename))[0])
+            if results['resolutions'][idx] is not None:
+                results['resolutions'][idx] = None
+                results['success'] -= 1
+                results['failed'] += 1
+        
+        results['resolutions'] = [(idx, *slot) for idx, slot in enumerate(results['resolutions']) if slot is not None]
         
         print("\nCrawl Summary:")
         print(f"Total images processed: {results['total']}")
@@ -431,8 +1359,6 @@ class PIPACrawler:
 
 
 def main():
-    import argparse
-    
     parser = argparse.ArgumentParser(description='Download PIPA dataset images in highest available resolution without Flickr API key')
     parser.add_argument('--data-file', type=str, default='all_data.txt',
                         help='Path to all_data.txt file (default: all_data.txt)')
@@ -441,22 +1367,38 @@ def main():
     parser.add_argument('--limit', type=int, default=None,
                         help='Limit the number of images to download (default: download all)')
     parser.add_argument('--workers', type=int, default=1,
-                        help='Number of parallel download workers (default: 1)')
+                        help='Number of parallel workers for resolving URLs and for downloading images (default: 1)')
     parser.add_argument('--delay', type=float, default=1.0,
-                        help='Delay between requests in seconds (default: 1.0)')
+                        help='Average delay between Flickr page requests in seconds, per worker; image '
+                             'downloads are rate limited separately at 4x this rate; 0 disables rate '
+                             'limiting (default: 1.0)')
+    parser.add_argument('--client', choices=['requests', 'httpx'], default='requests',
+                        help='HTTP client; httpx uses HTTP/2 and needs httpx[http2] installed (default: requests)')
     parser.add_argument('--retries', type=int, default=3,
-                        help='Maximum number of retries for failed downloads (default: 3)')
+                        help='Maximum number of retries for failed requests (default: 3)')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='Log each downloaded image; repeat (-vv) to also log every URL tried')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Revalidate images that already exist with conditional requests and '
+                             'download them again if they changed on Flickr')
     
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
     
-    crawler = PIPACrawler(
+    log_levels = [logging.WARNING, logging.INFO, logging.DEBUG]
+    logging.basicConfig(level=log_levels[min(args.verbose, len(log_levels) - 1)], format='%(message)s')
+    
+    with PIPACrawler(
         data_file=args.data_file,
         output_dir=args.output_dir,
         max_retries=args.retries,
-        delay=args.delay
-    )
-    
-    crawler.crawl(limit=args.limit, num_workers=args.workers)
+        delay=args.delay,
+        num_workers=args.workers,
+        client=args.client,
+        refresh=args.refresh
+    ) as crawler:
+        crawler.crawl(limit=args.limit, num_workers=args.workers)
 
 
 if __name__ == "__main__":